@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
-import re, os, stat, functools
+import re, os, stat
 
 from stat import *
 from operator import or_
 from functools import reduce
 
-__all__ = ['chmod', 'vchmod', 'schmod', 'fchmod', 'lchmod']
+from util import memoize
+
+__all__ = [
+    'chmod', 'chmod_st', 'vchmod', 'schmod', 'fchmod', 'lchmod',
+    'compile_mode',
+]
 
 _WHO = {'u': 'USR', 'g': 'GRP', 'o': 'OTH'}
 _MOD = re.compile(r'''
@@ -22,22 +27,8 @@ _MOD = re.compile(r'''
     )\Z                             # end of string
 ''', re.VERBOSE)
 
-def or_all(fn, items):
-    return reduce(or_, map(fn, items))
-
-# @functools.cache is only in Python 3.9+, so provide fall back to lru_cache
-def memoize(fn):
-    decorator = getattr(functools, 'cache', functools.lru_cache(maxsize=None))
-    return decorator(fn)
-
-def bits(who, perm, type_=None):
-    if who in ('a', ''): who = 'ugo'
-    if len(who) > 1: return or_all(lambda w: bits(w, perm, type_), who)
-    if len(perm) > 1: return or_all(lambda p: bits(who, p, type_), perm)
-
-    if perm == '':
-        return 0
-    elif perm == 'X':
+def _bits1(who, perm, type_=None):
+    if perm == 'X':
         return getattr(stat, f'S_IX{_WHO[who]}') if type_ == 'D' else 0
     elif perm == 's':
         if who == 'u': return S_ISUID
@@ -48,6 +39,72 @@ def bits(who, perm, type_=None):
     elif perm == '*': return getattr(stat, f'S_IRWX{who.upper()}')
     else: return getattr(stat, f'S_I{perm.upper()}{_WHO[who]}')
 
+# every (who, perm, type) combination is enumerable, so precompute tables
+# indexed by (who bitmap, perm bitmap); any combination then resolves with
+# a single lookup instead of an O(|who|*|perm|) reduce
+_WHO_BIT = {'u': 1, 'g': 2, 'o': 4}
+_PERM_BIT = {'r': 1, 'w': 2, 'x': 4, 'X': 8, 's': 16, 't': 32}
+_TYPE_IDX = {None: 0, 'F': 1, 'D': 2}
+_BITS_TABLE = [
+    [
+        [
+            reduce(or_, (
+                _bits1(w, p, t)
+                for w in 'ugo' if _WHO_BIT[w] & wb
+                for p in 'rwxXst' if _PERM_BIT[p] & pb
+            ), 0)
+            for pb in range(64)
+        ]
+        for wb in range(8)
+    ]
+    for t in (None, 'F', 'D')
+]
+
+def bits(who, perm, type_=None):
+    # `a` means all three sets even mixed with u/g/o (e.g. `ua+r`)
+    if '' == who or 'a' in who:
+        wb = 7
+    else:
+        wb = reduce(or_, map(_WHO_BIT.__getitem__, who))
+    if '*' in perm: perm = perm.replace('*', 'rwx')
+    pb = reduce(or_, map(_PERM_BIT.__getitem__, perm), 0)
+    return _BITS_TABLE[_TYPE_IDX[type_]][wb][pb]
+
+def _is_octal(s):
+    # equivalent of the regex fragment `0*[0-7]{3,4}`
+    if len(s) < 3 or not all(c in '01234567' for c in s):
+        return False
+    return len(s) <= 4 or set(s[:len(s)-4]) == {'0'}
+
+def parse_clause(s):
+    # hand-rolled equivalent of _MOD for well-formed clauses; skips the
+    # regex engine and named-group bookkeeping on the hot (cold-parse) path
+    i, n = 0, len(s)
+    type_ = None
+    if i < n and s[i] in 'FD':
+        type_, i = s[i], i + 1
+
+    # operation with optional operator, octal mode
+    rest = s[i:]
+    if rest and rest[0] in '+=-' and _is_octal(rest[1:]):
+        return (type_, None, rest[0], None, None, rest[1:])
+    if _is_octal(rest):
+        return (type_, None, None, None, None, rest)
+
+    # who, operator, then reference set / symbolic mode / octal mode
+    j = i
+    while j < n and s[j] in 'augo': j += 1
+    if j >= n or s[j] not in '+=-':
+        return None
+    who, op, rest = s[i:j], s[j], s[j+1:]
+    if len(rest) == 1 and rest in 'ugo':
+        return (type_, who, op, rest, None, None)
+    if all(c in 'rwxXts' for c in rest):
+        return (type_, who, op, None, rest, None)
+    if _is_octal(rest):
+        return (type_, who, op, None, None, rest)
+    return None
+
 def bits_and_or(type_, who, op, octal, sym):
     bits_and, bits_or = 0o7777, 0o0
     if octal:
@@ -110,6 +167,7 @@ def chref(src, dst):
 @memoize
 def parse(mode):
     changes, n = [], 0
+    file_and, dir_and, file_or, dir_or = 0o7777, 0o7777, 0o0, 0o0
 
     for s in mode.split(','):
         if n == 0:
@@ -117,12 +175,19 @@ def parse(mode):
             file_and, dir_and, file_or, dir_or = 0o7777, 0o7777, 0o0, 0o0
 
         # try to break down a mode updating directive
-        m = _MOD.match(s)
-        if m:
-            type_, who = m.group('type'), m.group('who')
-            sym, ref = m.group('sym'), m.group('ref')
-            op = m.group('op1') or m.group('op2')
-            octal = m.group('oct1') or m.group('oct2')
+        clause = parse_clause(s)
+        if clause is None:
+            # fall back to the regex so malformed input fails the same way
+            m = _MOD.match(s)
+            if m:
+                clause = (
+                    m.group('type'), m.group('who'),
+                    m.group('op1') or m.group('op2'),
+                    m.group('ref'), m.group('sym'),
+                    m.group('oct1') or m.group('oct2'),
+                )
+        if clause:
+            type_, who, op, ref, sym, octal = clause
 
             if ref is not None:
                 # generate and push a mode updater from bitmasks, queue reset
@@ -132,35 +197,41 @@ def parse(mode):
                 # generate and push mode updaters from reference
                 for c in who: changes.append(chref(ref, c))
             else:
+                # fold the directive into the running bitmask pair
                 n += 1
                 if type_ != 'D':
                     bits_and, bits_or = bits_and_or('F', who, op, octal, sym)
-                    #print(f'F&{bits_and:04o}')
-                    #print(f'F|{bits_or:04o}')
                     file_and &= bits_and
                     file_or = (file_or & bits_and) | bits_or
                 if type_ != 'F':
                     bits_and, bits_or = bits_and_or('D', who, op, octal, sym)
-                    #print(f'D&{bits_and:04o}')
-                    #print(f'D|{bits_or:04o}')
                     dir_and &= bits_and
                     dir_or = (dir_or & bits_and) | bits_or
         else:
             raise ValueError(f'invalid mode: `{mode}`')
 
-    # generate and push a mode updater from bitmasks if needed
-    if n > 0: changes.append(chbits(file_and, dir_and, file_or, dir_or))
-
-    if len(changes) == 1:
-        update = changes[0]
-    else:
+    if len(changes) == 0:
+        # common case: no references, so every directive has been fused into
+        # four ints and the update is a single mask/or
         def update(mode, isdir):
-            for change in changes: mode = change(mode, isdir)
-            return mode
+            if isdir: return (mode & dir_and) | dir_or
+            return (mode & file_and) | file_or
+    else:
+        # generate and push a mode updater from bitmasks if needed
+        if n > 0: changes.append(chbits(file_and, dir_and, file_or, dir_or))
+
+        if len(changes) == 1:
+            update = changes[0]
+        else:
+            def update(mode, isdir):
+                for change in changes: mode = change(mode, isdir)
+                return mode
 
     return memoize(update)
 
 def stat_result(stat, **kwargs):
+    # nothing to change, nothing to rebuild
+    if not kwargs: return stat
     basic = (
         kwargs.get('st_mode',  stat[0]),
         kwargs.get('st_ino',   stat[1]),
@@ -174,9 +245,15 @@ def stat_result(stat, **kwargs):
         int(kwargs.get('st_ctime', stat[9])),
     )
     extra = stat.__reduce__()[1][1]
-    for k, v in kwargs.items(): extra[k] = v
+    extra.update(kwargs)
     return os.stat_result(basic, extra)
 
+# parse a mode string once and get back update(perm, isdir); lets callers
+# applying the same mode to many files skip the per-call memo lookup, which
+# hashes the mode string every time
+def compile_mode(mode):
+    return parse(mode)
+
 @memoize
 def _vchmod(perm, mode, isdir):
     update = parse(mode)
@@ -196,17 +273,19 @@ def vchmod(perm, mode, isdir=None):
     return _vchmod(perm, mode, isdir)
 
 def schmod(st, mode):
-    # get basic atrributes in a modifiable form
-    l = list(perm)
-    # update st_mode
-    l[0] = S_IFMT(l[0]) | _vchmod(S_IMODE(l[0]), mode, S_ISDIR(l[0]))
-    # get extra attributes
-    d = {k: getattr(st, k) for k in dir(st) if k.startswith('st_')}
-    return os.stat_result(l, d)
+    m = st.st_mode
+    return stat_result(
+        st, st_mode=S_IFMT(m) | _vchmod(S_IMODE(m), mode, S_ISDIR(m))
+    )
 
 def chmod(path, mode, *, dir_fd=None, follow_symlinks=True):
     st = os.stat(path, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
-    mode = S_IMODE(schmod(st, mode).st_mode)
+    return chmod_st(st, path, mode, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
+
+# fast path for callers that already hold a stat result for the path; skips
+# the extra os.stat (and its path traversal) that chmod() would repeat
+def chmod_st(st, path, mode, *, dir_fd=None, follow_symlinks=True):
+    mode = _vchmod(S_IMODE(st.st_mode), mode, S_ISDIR(st.st_mode))
     return os.chmod(path, mode, dir_fd=dir_fd, follow_symlinks=follow_symlinks)
 
 def fchmod(fd, mode):
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import re
 import sys
 import json
 import codecs
@@ -23,42 +24,72 @@ class ConcatonatedJSONDecodeError(json.JSONDecodeError):
 class ConcatonatedJSONDecoder:
     def __init__(self, decoder, *, separators = WHITESPACE, **kwargs):
         self._decoder = decoder or json.JSONDecoder(**kwargs)
+        self._raw_decode = self._decoder.raw_decode
+        # normalize to a str; membership against a short str beats a set
+        # hash lookup, and the skip regex wants one anyway
+        if not isinstance(separators, str): separators = ''.join(separators)
         self._separators = separators
+        self._sep_skip = re.compile('[%s]*' % re.escape(separators))
         self._buffer = ''
+        self._start = 0
         self._offset = 0
 
     def _advance(self, n):
-        self._buffer = self._buffer[n:]
+        # move an integer cursor instead of reslicing the buffer, which
+        # copies the whole tail once per decoded object; only trim once the
+        # consumed prefix dominates the buffer
+        self._start += n
         self._offset += n
+        if self._start > 4096 and self._start * 2 > len(self._buffer):
+            self._buffer = self._buffer[self._start:]
+            self._start = 0
 
-    def generate(self, s=''):
+    def generate(self, s='', final=False):
         self._buffer += s
-        while len(self._buffer):
-            if self._buffer[0] in self._separators:
-                self._advance(1)
+        # bind the per-object lookups once; note _advance may replace
+        # self._buffer, so that one can't be hoisted
+        raw_decode = self._raw_decode
+        sep_skip = self._sep_skip.match
+        while self._start < len(self._buffer):
+            # skip runs of separators in one C call rather than one pass of
+            # the loop per character
+            end = sep_skip(self._buffer, self._start).end()
+            if end > self._start:
+                self._advance(end - self._start)
                 continue
 
             try:
-                (o, c) = self._decoder.raw_decode(self._buffer)
+                (o, c) = raw_decode(self._buffer, self._start)
             except json.JSONDecodeError as e:
-                raise ConcatonatedJSONDecodeError(e.msg, e.pos + self._offset)
-            self._advance(c)
+                # an error at the very end of the buffer usually just means
+                # the rest of the value hasn't arrived yet; wait for more
+                if not final and e.pos >= len(self._buffer): return
+                raise ConcatonatedJSONDecodeError(
+                    e.msg, e.pos - self._start + self._offset
+                )
+            self._advance(c - self._start)
             yield o
 
     def __len__(self):
-        return len(self._buffer)
+        return len(self._buffer) - self._start
 
 def load(fp, *, cls=None, encoding='utf-8', errors='strict', chunk_size=(1<<16), **kwargs):
     decoder = cls(**kwargs) if cls else json.JSONDecoder(**kwargs)
     chunk_size = max(4, chunk_size)
     incr = ConcatonatedJSONDecoder(decoder)
 
-    # we're using raw_decode which requires strings, so wrap binary files
+    # we're using raw_decode which requires strings, so decode binary files
+    # incrementally; getreader's StreamReader adds another buffering layer
+    # and re-reads when a chunk splits a multi-byte character
+    decode = None
     if isinstance(fp.read(0), bytes):
-        fp = codecs.getreader(encoding)(fp, errors)
+        decode = codecs.getincrementaldecoder(encoding)(errors).decode
 
     saved_error = None
-    for chunk in iter(lambda: fp.read(chunk_size), ''):
+    for chunk in iter(lambda: fp.read(chunk_size), b'' if decode else ''):
+        if decode:
+            chunk = decode(chunk)
+            if not chunk: continue
         try:
             yield from incr.generate(chunk)
             saved_error = None
@@ -66,12 +97,22 @@ def load(fp, *, cls=None, encoding='utf-8', errors='strict', chunk_size=(1<<16),
             saved_error = e
             # XXX TODO: try to detect conditions that can't be recovered from
 
+    if decode and (chunk := decode(b'', True)):
+        try:
+            yield from incr.generate(chunk)
+            saved_error = None
+        except json.JSONDecodeError as e:
+            saved_error = e
+
     if saved_error:
         raise saved_error
 
+    # anything left in the buffer at EOF is a truncated value
+    yield from incr.generate(final=True)
+
 def loads(s, *, cls=None, encoding='utf-8', errors='strict', **kwargs):
     decoder = cls(**kwargs) if cls else json.JSONDecoder(**kwargs)
     if isinstance(s, (bytes, bytearray)):
         s = s.decode(encoding, errors)
 
-    yield from ConcatonatedJSONDecoder(decoder).generate(s)
+    yield from ConcatonatedJSONDecoder(decoder).generate(s, final=True)
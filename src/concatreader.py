@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# present a sequence of binary streams as a single concatenated read stream
+
+from io import RawIOBase, BufferedReader, DEFAULT_BUFFER_SIZE
+from os import SEEK_SET, SEEK_CUR, SEEK_END
+from bisect import bisect_right
+
+__all__ = ['ConcatReader']
+
+# internal helper class, wrapped by ConcatReader for buffering
+class _ConcatReader(RawIOBase):
+    # attribute access through slot descriptors is faster than a dict
+    # lookup, and these are hit on every read
+    __slots__ = ('_io_tup', '_io_idx', '_io_range', '_io_starts', '_pos')
+
+    def __init__(self, *files):
+        self._io_tup = tuple(files)
+        self._io_idx = 0
+        self._pos = 0
+        # byte ranges covered by each stream, when all streams are seekable
+        try:
+            ranges, start = [], 0
+            for f in self._io_tup:
+                end = start + f.seek(0, SEEK_END)
+                f.seek(0, SEEK_SET)
+                ranges.append((start, end))
+                start = end
+            self._io_range = tuple(ranges)
+            self._io_starts = tuple(start for start, end in ranges)
+        except (AttributeError, OSError):
+            self._io_range = None
+            self._io_starts = None
+
+    def _get_io(self):
+        if self._io_idx >= len(self._io_tup): return None
+        return self._io_tup[self._io_idx]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._io_range is not None
+
+    def readinto(self, b):
+        # iterate rather than recurse so crossing stream boundaries costs a
+        # loop pass, not a new frame and memoryview slice per boundary; keep
+        # loop state in locals, attribute access costs add up in here
+        io_tup, idx = self._io_tup, self._io_idx
+        n_tup = len(io_tup)
+        mv, total, size = memoryview(b), 0, len(b)
+        while total < size and idx < n_tup:
+            n = io_tup[idx].readinto(mv[total:])
+            if n is None:
+                self._io_idx = idx
+                self._pos += total
+                return total if total else None
+            elif n == 0:
+                idx += 1
+                continue
+            total += n
+        self._io_idx = idx
+        self._pos += total
+        return total
+
+    def _read(self, size=-1):
+        # read from the current stream, advancing past exhausted ones
+        io_tup, idx = self._io_tup, self._io_idx
+        n_tup = len(io_tup)
+        while idx < n_tup:
+            data = io_tup[idx].read(size)
+            if data is None:
+                self._io_idx = idx
+                return None
+            elif len(data) == 0:
+                idx += 1
+                continue
+            self._io_idx = idx
+            self._pos += len(data)
+            return data
+        self._io_idx = idx
+        return None
+
+    def read(self, size=-1):
+        if size is None or size < 0: return self.readall()
+        data = self._read(size)
+        return b'' if data is None else data
+
+    def readall(self):
+        # accumulate into a bytearray; bytes += recopies both operands per
+        # chunk, which goes quadratic over many backing streams
+        buf = bytearray()
+        while (data := self._read()):
+            buf += data
+        return bytes(buf)
+
+    def seek(self, offset, whence=SEEK_SET):
+        if self._io_range is None:
+            raise OSError('underlying stream is not seekable')
+
+        if whence == SEEK_SET: new_pos = offset
+        elif whence == SEEK_CUR: new_pos = self._pos + offset
+        elif whence == SEEK_END:
+            new_pos = (self._io_range[-1][1] if self._io_range else 0) + offset
+        else: raise ValueError(f'invalid whence: {whence}')
+
+        if new_pos < 0:
+            raise OSError('negative seek position')
+
+        # find the stream containing the new position in O(log n)
+        idx = bisect_right(self._io_starts, new_pos) - 1
+        if 0 <= idx < len(self._io_tup) and new_pos < self._io_range[idx][1]:
+            self._io_tup[idx].seek(new_pos - self._io_starts[idx], SEEK_SET)
+            # rewind anything after it that may have been read already
+            for later in self._io_tup[idx+1:]: later.seek(0, SEEK_SET)
+            self._io_idx = idx
+        else:
+            self._io_idx = len(self._io_tup)
+
+        self._pos = new_pos
+        return new_pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            for io in self._io_tup: io.close()
+        super().close()
+
+class ConcatReader(BufferedReader):
+    def __init__(self, *files, buffer_size=None):
+        raw = _ConcatReader(*files)
+        if buffer_size is None:
+            # when the total size is known, buffer up to 1MiB so fewer,
+            # larger readinto calls reach the raw layer
+            if raw._io_range:
+                buffer_size = min(raw._io_range[-1][1], 1 << 20)
+            buffer_size = max(buffer_size or 0, DEFAULT_BUFFER_SIZE)
+        super().__init__(raw, buffer_size)
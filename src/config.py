@@ -7,10 +7,12 @@ class ParseError(Exception):
     pass
 
 raw_decode = json.JSONDecoder().raw_decode
+# keys and quoting are ASCII, so re.ASCII keeps `\s`/`\w` out of the
+# unicode property tables
 comment = re.compile(r'''
     \s*                         # zero or more spaces
-    (?:#.*)?                    # optionally, `#` followed by anything
-''', re.VERBOSE)
+    (?:\#.*)?                   # optionally, `#` followed by anything
+''', re.VERBOSE | re.ASCII)
 sep = re.compile(rf'''
     \s*                         # zero or more spaces
     (?:                         # begin uncaptured group
@@ -25,8 +27,7 @@ sep = re.compile(rf'''
             {comment.pattern}   # optional comment
         )                       # end uncaptured group
     )                           # end uncaptured group
-    \Z                          # end of string
-''', re.VERBOSE)
+''', re.VERBOSE | re.ASCII)
 
 def _parse_json(fileobj=None):
     return json.load(fileobj)
@@ -34,14 +35,25 @@ def _parse_json(fileobj=None):
 def _parse_simple(fileobj=None):
     data = {}
     for lineno, line in enumerate(map(lambda x: x.strip(), fileobj), 1):
-        m = sep.match(line)
+        # fast path: blank lines, comments, and unquoted KEY=value with no
+        # trailing comment cover most input, and need no regex at all
+        if not line or line.startswith('#'):
+            continue
+        key, eq, value = line.partition('=')
+        if eq and '#' not in value and '"' not in value:
+            key = key.rstrip()
+            if key.isascii() and key.isidentifier():
+                data[key] = value.strip()
+                continue
+
+        m = sep.fullmatch(line)
         if m is None:
             raise ParseError(f'Invalid syntax: {fileobj.name}, line {lineno}')
         key, quoted, value = m.groups()
         if key:
             if quoted:
                 value, pos = raw_decode(quoted)
-                if not com.match(q[pos:]):
+                if not comment.fullmatch(quoted[pos:]):
                     raise ParseError(f'Invalid syntax: {fileobj.name}, line {lineno}')
 
             data[key] = value
@@ -6,18 +6,26 @@ import tarfile
 import functools
 import subprocess
 
-from io import BytesIO, BufferedIOBase
-from os import walk, fdopen, stat, stat_result, path, getcwd, chdir, SEEK_SET, SEEK_END
-from collections import namedtuple, defaultdict, OrderedDict
-from base64 import b64decode as b64d
+from io import BytesIO
+from os import scandir, fdopen, makedirs, stat, stat_result, path, getcwd, chdir, environ, getuid, SEEK_SET, SEEK_END
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # pip3 install pybase64 - SIMD base64 codec, same signature
+    from pybase64 import b64decode as b64d
+except ImportError:
+    from base64 import b64decode as b64d
 from functools import partial, lru_cache
-from itertools import chain
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile, gettempdir
+from threading import Thread
+from stat import S_ISREG, S_ISDIR, S_IMODE
 from time import time
 
 try:
-    from collections.abc import Iterable
-except (ModuleNotFoundError, ImportError):
-    from collections import Iterable
+    from os import sendfile
+except ImportError:
+    sendfile = None
 
 # bundled
 import concatjson
@@ -62,17 +70,22 @@ def jinja_filters():
     try:
         import crypt
 
+        # memoized: hashing is deliberately slow, and templates tend to
+        # render the same credentials into many files
         @filters.register('md5_crypt')
+        @memoize
         def md5_crypt(string, salt=None):
-            return crypt.crypt(string, ('$1$' + salt) or crypt.METHOD_MD5)
+            return crypt.crypt(string, '$1$' + salt if salt else crypt.METHOD_MD5)
 
         @filters.register('sha256_crypt')
+        @memoize
         def sha256_crypt(string, salt=None):
-            return crypt.crypt(string, ('$5$' + salt) or crypt.METHOD_SHA256)
+            return crypt.crypt(string, '$5$' + salt if salt else crypt.METHOD_SHA256)
 
         @filters.register('sha512_crypt')
+        @memoize
         def sha512_crypt(string, salt=None):
-            return crypt.crypt(string, ('$6$' + salt) or crypt.METHOD_SHA512)
+            return crypt.crypt(string, '$6$' + salt if salt else crypt.METHOD_SHA512)
 
     except ModuleNotFoundError:
         pass
@@ -82,14 +95,17 @@ def jinja_filters():
         from passlib.hash import md5_crypt, sha256_crypt, sha512_crypt
 
         @filters.register('md5_crypt')
+        @memoize
         def md5_crypt(string, salt=None):
             return passlib.hash.md5_crypt.using(salt=salt).hash(string)
 
         @filters.register('sha256_crypt')
+        @memoize
         def sha256_crypt(string, salt=None):
             return passlib.hash.sha256_crypt.using(rounds=5000, salt=salt).hash(string)
 
         @filters.register('sha512_crypt')
+        @memoize
         def sha512_crypt(string, salt=None):
             return passlib.hash.sha512_crypt.using(rounds=5000, salt=salt).hash(string)
 
@@ -101,7 +117,9 @@ def jinja_filters():
             return crypt
 
         for algo in ('md5_crypt', 'sha256_crypt', 'sha512_crypt'):
-            filters.register(algo)(bad_crypt(algo))
+            # don't clobber the crypt-module versions registered above
+            if algo not in filters:
+                filters.register(algo)(bad_crypt(algo))
 
     def make_hexdigest(algo):
         hasher = getattr(hashlib, algo)
@@ -124,15 +142,34 @@ def jinja_functions():
 
     @functions.register
     def randint(a, b, fmt=''):
-        n = random.randint(a, b)
-        return ('{:'+fmt+'}').format(n)
+        # format() takes the spec directly; no template string to rebuild
+        return format(random.randint(a, b), fmt)
 
     return functions
 
 SEP = path.sep
-EXPN1 = re.compile(r'(?<!\\)\$\{(\w+)\}')
-EXPN2 = re.compile(r'(?<!\\)\\\$')
+# our own pattern cache; re's internal one is capped at 512 entries and
+# shared with every other re call in the process
+recompile = memoize(re.compile)
+# definition names are plain identifiers; ASCII \w skips the unicode tables
+EXPN = re.compile(r'(?<!\\)\$\{(\w+)\}|(?<!\\)\\\$', re.ASCII)
+
+@lru_cache(maxsize=4096)
+def _stat_cached(path):
+    # the same source path can appear in several entries (filtered and
+    # templated variants); one lstat per unique path covers them all
+    return stat(path, follow_symlinks=False)
+
+@lru_cache(maxsize=4096)
+def expn_split(s):
+    # tokenize a template string once per unique value: literals at even
+    # indices, variable names (None for an escaped \$) at odd; manifest
+    # templates recur across entries, so repeats skip the regex entirely
+    return EXPN.split(s)
 SPECIALS = ('link', 'fifo', 'block', 'char', 'dir')
+# keys that give Entry.apply() something to do
+METAKEYS = SPECIALS + ('mode', 'mtime', 'uid', 'gid', 'uname', 'gname',
+                       'atime', 'ctime', 'include', 'exclude')
 # from libarchive - https://git.io/JyREM
 EXTMAP = defaultdict(lambda: '', {
     k: v
@@ -145,16 +182,25 @@ EXTMAP = defaultdict(lambda: '', {
     for k in keys
 })
 
-QueuedInfo = namedtuple('QueuedInfo', ['src', 'thunk'])
+# lighter than a namedtuple; queues can hold hundreds of thousands of these
+class QueuedInfo:
+    __slots__ = ('src', 'kind', 'args')
+
+    def __init__(self, src, kind, args):
+        self.src = src
+        self.kind = kind
+        self.args = args
 
 class Entry:
-    def __init__(self, entry, define=None):
+    def __init__(self, entry, define=None, stat=None):
         if multiplein(entry, SPECIALS):
             raise ValueError('Invalid entry contains multiple special keys')
 
         self._entry = entry
-        self._stat = None
+        self._stat = stat
         self._define = define
+        # bound once; _expand runs for every source and name
+        self._get = (define or {}).get
 
         if entry.get('source', '').startswith('tar:'):
             member = tarmember(entry['source'])
@@ -175,52 +221,119 @@ class Entry:
             if 'gname' not in entry and entry.get('gid', None) != 0:
                 self.gname = member.gname
 
-    def sub(self, source, name=None):
+        # resolve the mode callable once instead of building a fresh
+        # partial (and reparsing octal strings) on every attribute access
+        if 'link' in entry:
+            # symlink permissions are always 777
+            self._mode_fn = lambda: 0o777
+        elif 'mode' in entry:
+            value = entry['mode']
+            if isinstance(value, int): value = str(value)
+            if self.stat:
+                self._mode_fn = partial(vchmod, self.stat, value)
+            else:
+                mode = int(value, 8)
+                self._mode_fn = lambda: mode
+        else:
+            self._mode_fn = None
+
+        # queue() reads each of these once per entry; resolve them eagerly
+        # so the lookups are plain instance-dict hits instead of a trip
+        # down the __getattr__ chain (hasattr results are unchanged: the
+        # lazy defaults never raised)
+        get = entry.get
+        self.template = get('template', False)
+        self.recursive = get('recursive', False)
+        self.filter = get('filter', None)
+        self.include = get('include', None)
+        self.exclude = get('exclude', None)
+
+    def sub(self, source, name=None, stat=None):
         entry = self._entry.copy()
         entry['source'] = source
         if name is None: entry.pop('name', None)
         else: entry['name'] = name
         entry.pop('recursive', None)
-        return Entry(entry, self._define)
+        return Entry(entry, self._define, stat)
+
+    def sub_factory(self):
+        # specialized sub() for the recursive walk: copy the template dict
+        # and drop the constant keys once, not per generated entry
+        base = self._entry.copy()
+        base.pop('name', None)
+        base.pop('recursive', None)
+        define = self._define
+        def sub(source, name, stat=None):
+            entry = base.copy()
+            entry['source'] = source
+            entry['name'] = name
+            return Entry(entry, define, stat)
+        return sub
+
+    @property
+    def inert(self):
+        # nothing for apply() to veto or change: no metadata keys and no
+        # stat to pull times from (stat-backed entries emit pax atime/ctime)
+        if anyin(self._entry, METAKEYS): return False
+        return self.stat is None
+
+    def materialize(self):
+        # resolve every applicable attribute with one __getattr__ dispatch
+        # per key; apply() used to pay hasattr plus getattr for each
+        vals = {}
+        for k in ('mode', 'mtime', 'uid', 'gid', 'uname', 'gname', 'atime', 'ctime'):
+            try: vals[k] = getattr(self, k)
+            except AttributeError: pass
+        return vals
 
     def apply(self, info):
-        if hasattr(self, 'block'):
+        e = self._entry
+        if 'block' in e:
             info.type = tarfile.BLKTYPE
             info.devmajor, info.devminor = self.block
-        elif hasattr(self, 'char'):
+        elif 'char' in e:
             info.type = tarfile.CHRTYPE
             info.devmajor, info.devminor = self.char
-        elif hasattr(self, 'link'):
+        elif 'link' in e:
             info.type, info.linkname = tarfile.SYMTYPE, self.link
-        elif getattr(self, 'fifo', False):
+        elif e.get('fifo', False):
             info.type = tarfile.FIFOTYPE
-        elif getattr(self, 'dir', False):
+        elif e.get('dir', False):
             info.type = tarfile.DIRTYPE
 
-        if hasattr(self, 'mode'):
-            info.mode = self.mode()
+        vals = self.materialize()
+        mode = vals.pop('mode', None)
+        if mode is not None: info.mode = mode()
 
         for k in ('mtime', 'uid', 'gid', 'uname', 'gname'):
-            if hasattr(self, k): setattr(info, k, getattr(self, k))
+            if k in vals: setattr(info, k, vals[k])
 
         for k in ('atime', 'ctime'):
-            if hasattr(self, k): info.pax_headers[k] = str(getattr(self, k))
+            if k in vals: info.pax_headers[k] = str(vals[k])
 
         if self.include is not None:
-            if not re.fullmatch(self.include, info.name):
+            if not recompile(self.include).fullmatch(info.name):
                 return None
 
         if self.exclude is not None:
-            if re.fullmatch(self.exclude, info.name):
+            if recompile(self.exclude).fullmatch(info.name):
                 return None
 
         return info
 
     def _expand(self, s):
-        # expand placeholders in the format of ${varible_name}
-        s = EXPN1.sub(lambda m: self._define.get(m.group(1)), s)
-        # unescape any $ characters
-        return EXPN2.sub('$', s)
+        # most strings (every walked path, for one) have nothing to expand;
+        # a C-level scan settles that without touching the token cache
+        if '$' not in s: return s
+        # expand ${variable_name} placeholders and unescape \$ by joining
+        # the cached token list; no regex callback per match
+        toks = expn_split(s)
+        if len(toks) == 1: return s
+        get = self._get
+        return ''.join(
+            (get(t) if t is not None else '$') if i & 1 else t
+            for i, t in enumerate(toks)
+        )
 
     def __repr__(self):
         return self._entry.__repr__()
@@ -229,6 +342,14 @@ class Entry:
     def __contains__(self, item): return hasattr(self, item)
 
     def __getattr__(self, name):
+        value = self._resolve(name)
+        # time-derived keys can change between reads; everything else is
+        # stable, so park it where future lookups skip __getattr__ entirely
+        if name not in ('stat', 'atime', 'ctime', 'mtime'):
+            self.__dict__[name] = value
+        return value
+
+    def _resolve(self, name):
         if name == 'stat':
             if self._stat is None:
                 # no actual file to stat
@@ -236,13 +357,12 @@ class Entry:
                 elif self.source.startswith('base64:'): return None
                 elif self.source.startswith('tar:'): return None
                 # save data from source file
-                else: self._stat = stat(self.source, follow_symlinks=False)
+                else: self._stat = _stat_cached(self.source)
 
             return self._stat
 
-        # symlink permissions are always 777
-        elif name == 'mode' and 'link' in self._entry:
-            return lambda: 0o777
+        elif name == 'mode' and self._mode_fn is not None:
+            return self._mode_fn
 
         # source is required except for symlinks and specials
         elif name == 'source':
@@ -263,12 +383,7 @@ class Entry:
         # optional attributes
         elif name in self._entry:
             value = self._entry[name]
-            if name == 'mode':
-                if isinstance(value, int): value = str(value)
-                # returns fn()
-                if self.stat: return partial(vchmod, self.stat, value)
-                return lambda: int(value, 8)
-            elif name in ('atime', 'ctime'):
+            if name in ('atime', 'ctime'):
                 if value == 'now':
                     return time()
                 elif value == 'stat' and self.stat:
@@ -289,10 +404,6 @@ class Entry:
         elif name == 'uname' and self._entry.get('uid', None) == 0: return 'root'
         elif name == 'gname' and self._entry.get('gid', None) == 0: return 'root'
 
-        # defaults for keys not present below here
-        elif name in ('template', 'recursive'): return False
-        elif name in ('filter', 'include', 'exclude'): return None
-
         # fallback to stat
         elif self.stat:
             if hasattr(self.stat, 'st_' + name):
@@ -339,17 +450,22 @@ class ExtInfo(tarfile.TarInfo):
             self.children = self.tar.rootmember.children
             self.tar.rootmember = self
 
-        # find/create our direct parent node
-        parent = self.tar.rootmember
-        for i, part in enumerate(parts[:-1], 1):
-            name = '/'.join(parts[:i])
-            if part in parent.children:
-                parent = parent.children[part]
+        # find/create our direct parent node; grow the prefix as we walk
+        # instead of re-joining the whole path at every level
+        parent, cls, prefix = self.tar.rootmember, self.__class__, ''
+        for part in parts[:-1]:
+            # directory names repeat across members; interning dedups the key
+            # storage and makes the dict probes identity-compare
+            part = sys.intern(part)
+            prefix = part if not prefix else prefix + '/' + part
+            children = parent.children
+            if part in children:
+                parent = children[part]
                 continue
 
             # generate a virtual directory since one doesn't exist in the tree
-            virt = self.__class__(name='/'.join(parts[:i]), type_=VIRTTYPE)
-            parent.children[part] = virt
+            virt = cls(name=prefix, type_=VIRTTYPE)
+            children[part] = virt
             parent = virt
 
         # replace existing child if required
@@ -412,6 +528,8 @@ class ExtInfo(tarfile.TarInfo):
         else: raise TypeError(f'ExtInfo member {self.name} is not a regular file!')
 
     def add_to(self, target):
+        # virtual members only exist to shape the directory tree
+        if self.isvirt(): return
         if self.isfile():
             f = self.extractfile()
             self.tar = target
@@ -428,23 +546,98 @@ class TarSource(tarfile.TarFile):
     def open(cls, name=None, mode="r", fileobj=None):
         return super().open(name, mode, fileobj)
 
-for name in ('add', 'addfile', 'extract', 'extractall'):
-    def fn(self, *args, **kwargs):
-        raise NotImplementedError(f'TarSource instances do not support `{name}`!')
-    setattr(TarSource, name, fn)
+    # sources are read-only; explicit stubs instead of a setattr loop, whose
+    # shared closure made every one of these blame `extractall`
+    def add(self, *args, **kwargs):
+        raise NotImplementedError('TarSource instances do not support `add`!')
+
+    def addfile(self, *args, **kwargs):
+        raise NotImplementedError('TarSource instances do not support `addfile`!')
+
+    def extract(self, *args, **kwargs):
+        raise NotImplementedError('TarSource instances do not support `extract`!')
+
+    def extractall(self, *args, **kwargs):
+        raise NotImplementedError('TarSource instances do not support `extractall`!')
 
 @functools.lru_cache(maxsize=8)
 def tarmember(src):
     _, tar, member = src.split(':', 2)
     return TarSource.open(tar).getmember(member)
 
+try:
+    import pwd, grp
+except ImportError:
+    pwd = grp = None
+
+# tarfile.gettarinfo resolves uid/gid to names through NSS for every single
+# member; blind it and fill the names from memoized lookups instead
+tarfile.pwd = tarfile.grp = None
+
+@memoize
+def _uname(uid):
+    try:
+        return pwd.getpwuid(uid)[0] if pwd else ''
+    except KeyError:
+        return ''
+
+@memoize
+def _gname(gid):
+    try:
+        return grp.getgrgid(gid)[0] if grp else ''
+    except KeyError:
+        return ''
+
+# find a multi-threaded external compressor for the requested format; these
+# run on their own cores, overlapping compression with archive generation
+@memoize
+def compress_argv(compress, level=None):
+    from shutil import which
+    candidates = {
+        'gz': ('pigz',),
+        'bz2': ('pbzip2', 'lbzip2'),
+        'xz': ('pixz', 'xz'),
+    }
+    for cmd in candidates.get(compress, ()):
+        exe = which(cmd)
+        if exe is None: continue
+        argv = [exe]
+        if cmd == 'xz': argv.append('-T0')
+        if level is not None: argv.append(f'-{level}')
+        return argv
+    return None
+
 class TarBuilder(tarfile.TarFile):
     def __init__(self, *args, chdir=None, dirs='first', define={}, **kwargs):
         super().__init__(*args, **kwargs)
         self.dirs = dirs
         self.chdir = chdir
         self.define = define
-        self.queued = OrderedDict()
+        # plain dict preserves insertion order and is smaller and faster
+        self.queued = {}
+
+    @classmethod
+    def gzopen(cls, name=None, mode='r', fileobj=None, compresslevel=9, **kwargs):
+        if mode == 'w':
+            try:
+                # pip3 install isal - threaded gzip-compatible compressor
+                from isal import igzip_threaded
+            except ImportError:
+                pass
+            else:
+                # isal levels run 0-3; clamp the gzip-style level
+                fobj = igzip_threaded.open(
+                    fileobj if fileobj is not None else name, 'wb',
+                    compresslevel=min(compresslevel, 3), threads=4,
+                )
+                try:
+                    t = cls.taropen(name, mode, fobj, **kwargs)
+                except:
+                    fobj.close()
+                    raise
+                t._extfileobj = False
+                return t
+        return super().gzopen(name, mode, fileobj, compresslevel, **kwargs)
 
     @classmethod
     def zstopen(cls, name=None, mode='r', fileobj=None, compresslevel=None, **kwargs):
@@ -460,11 +653,21 @@ class TarBuilder(tarfile.TarFile):
         # auto-detect number of threads based on number of cpu cores
         zstdargs = dict(threads=-1)
         # if compresslevel is None, use module default by leaving level argument unset
-        if compresslevel is not None: zstdargs['level'] = compresslevel
+        if compresslevel is not None:
+            if compresslevel >= 19:
+                # at the high levels, long-distance matching pays off on
+                # tar streams full of similar small files
+                from zstandard import ZstdCompressionParameters
+                zstdargs = dict(compression_params=ZstdCompressionParameters
+                                .from_level(compresslevel, threads=-1,
+                                            enable_ldm=True, window_log=27))
+            else:
+                zstdargs['level'] = compresslevel
         compressor = ZstdCompressor(**zstdargs)
-        # ZstdCompressor only supports operating on stream objects
-        if fileobj is None: fileobj = open(name, 'rb')
-        fileobj = compressor.stream_writer(fileobj)
+        # ZstdCompressor only supports operating on stream objects; write in
+        # 1MiB chunks so fewer calls cross the extension boundary
+        if fileobj is None: fileobj = open(name, 'wb', buffering=(1 << 20))
+        fileobj = compressor.stream_writer(fileobj, write_size=(1 << 20))
 
         try:
             t = cls.taropen(None, mode, fileobj, **kwargs)
@@ -482,9 +685,13 @@ class TarBuilder(tarfile.TarFile):
                 raise TypeError(f"open() got an unexpected keyword argument '{kw}'")
 
         # open output
-        name, mode, fileobj = None, 'w', None
+        name, mode, fileobj, opened = None, 'w', None, None
         if isinstance(out, str):
+            # open the sink ourselves with a large write buffer so the many
+            # small header/padding writes tarfile makes get coalesced
             name = out
+            opened = fileobj = open(out, 'wb', buffering=(2 << 20))
+            mode = 'w:' + compress
         else:
             fileobj = out
             if getattr(out, 'seekable', lambda: False)():
@@ -492,18 +699,66 @@ class TarBuilder(tarfile.TarFile):
             else:
                 mode = 'w|' + compress
 
+        # pipe through an external parallel compressor when one is available
+        # and the sink has a real file descriptor to write to
+        proc = None
+        if compress:
+            argv = compress_argv(compress, level)
+            try:
+                fd = fileobj.fileno() if argv else None
+            except (AttributeError, OSError):
+                fd = None
+            if fd is not None:
+                proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=fd)
+                fileobj, mode = proc.stdin, 'w|'
+                compress, level = '', None
+
+        # the stdlib defaults gzip/bzip2 to level 9, which is far slower than
+        # level 6 for a marginal size win; pick 6 unless the caller asked
+        if level is None and compress in ('gz', 'bz2'): level = 6
+
         kwargs['format'], kwargs['chdir'], kwargs['define'] = format, chdir, define
-        if level is not None or compress in ('zst'):
-            if compress == 'gz':
-                return cls.gzopen(name, 'w', fileobj, compresslevel=level, **kwargs)
-            elif compress == 'bz2':
-                return cls.bz2open(name, 'w', fileobj, compresslevel=level, **kwargs)
-            elif compress == 'xz':
-                return cls.xzopen(name, 'w', fileobj, preset=level, **kwargs)
-            elif compress == 'zst':
-                return cls.zstopen(name, 'w', fileobj, compresslevel=level, **kwargs)
-
-        return super().open(name, mode, fileobj, **kwargs)
+        # tarfile copies file content in 16KiB chunks by default; bump it so
+        # member data moves in fewer, larger reads and writes
+        kwargs.setdefault('copybufsize', 2 << 20)
+        try:
+            t = None
+            if level is not None or compress == 'zst':
+                if compress == 'gz':
+                    t = cls.gzopen(name, 'w', fileobj, compresslevel=level, **kwargs)
+                elif compress == 'bz2':
+                    t = cls.bz2open(name, 'w', fileobj, compresslevel=level, **kwargs)
+                elif compress == 'xz':
+                    t = cls.xzopen(name, 'w', fileobj, preset=level, **kwargs)
+                elif compress == 'zst':
+                    t = cls.zstopen(name, 'w', fileobj, compresslevel=level, **kwargs)
+            if t is None:
+                if '|' in mode:
+                    # stream mode otherwise blocks writes at 20 records (10KiB)
+                    kwargs.setdefault('bufsize', 2 << 20)
+                t = super().open(name, mode, fileobj, **kwargs)
+        except:
+            if proc:
+                proc.stdin.close()
+                proc.wait()
+            if opened: opened.close()
+            raise
+
+        # compression wrappers don't close a fileobj handed to them, so
+        # remember to close (and thereby flush) the one we opened
+        if proc: t._comp_proc = proc
+        if opened: t._basefile = opened
+
+        # a plain uncompressed archive on a real fd can use kernel-side
+        # copies for member data
+        t._out_fd = None
+        if proc is None and not compress:
+            f = t.fileobj
+            # don't probe a spool: fileno() would force it to roll over
+            if not isinstance(f, SpooledTemporaryFile) or f._rolled:
+                try: t._out_fd = f.fileno()
+                except (AttributeError, OSError, ValueError): pass
+        return t
 
     @cached_property
     def env(self):
@@ -512,24 +767,57 @@ class TarBuilder(tarfile.TarFile):
         except ModuleNotFoundError:
             raise ModuleNotFoundError('Install `jinja2` to use templates.')
 
+        # compiled templates are cached without bound and persisted across
+        # runs; template sources can't change mid-build, so don't re-check
+        cache_dir = environ.get('JTAR_JINJA_CACHE')
+        if cache_dir:
+            makedirs(cache_dir, exist_ok=True)
+        else:
+            # the cache marshal-loads bytecode, so it must never be shared
+            # between users: prefer the per-user XDG cache dir, fall back
+            # to a uid-suffixed tempdir, and refuse one we don't own
+            home = path.expanduser('~')
+            if home != '~':
+                cache_home = environ.get('XDG_CACHE_HOME') \
+                    or path.join(home, '.cache')
+                cache_dir = path.join(cache_home, 'jtar-jinja')
+            else:
+                cache_dir = path.join(gettempdir(), f'jtar-jinja-{getuid()}')
+            makedirs(cache_dir, mode=0o700, exist_ok=True)
+            if stat(cache_dir).st_uid != getuid():
+                raise PermissionError(
+                    f'template cache `{cache_dir}` not owned by uid {getuid()}'
+                )
         env = jinja2.Environment(
             autoescape=False, keep_trailing_newline=True,
             loader=jinja2.FileSystemLoader(getcwd(), followlinks=True),
+            cache_size=-1, auto_reload=False,
+            bytecode_cache=jinja2.FileSystemBytecodeCache(cache_dir),
         )
         for k, v in jinja_filters().items(): env.filters[k] = v
         for k, v in jinja_functions().items(): env.globals[k] = v
         return env
 
+    @cached_property
+    def _from_string(self):
+        # inline templates keyed by source text
+        return lru_cache(maxsize=1024)(self.env.from_string)
+
     def _template(self, *, filename=None, filefunc=None):
         if filename is not None and filefunc is not None:
             raise ValueError('Either `filename` or `filefunc` must be non-None')
         elif filename is not None:
             template = self.env.get_template(filename)
         elif filefunc is not None:
-            template = self.env.from_string(filefunc().read().decode())
+            template = self._from_string(filefunc().read().decode())
         else: raise RuntimeError('Impossible!')
 
-        return BytesIO(template.render(self.define).encode())
+        # stream the rendering into a spool that spills to disk rather than
+        # materializing the whole output in RAM
+        spool = SpooledTemporaryFile(max_size=(8 << 20))
+        template.stream(self.define).dump(spool, 'utf-8')
+        spool.seek(0)
+        return spool
 
     def _add(self, *, filename=None, filefunc=None, arcname=None, filter=None):
         if arcname is None: arcname = filename
@@ -540,30 +828,143 @@ class TarBuilder(tarfile.TarFile):
         elif filefunc is not None:
             with filefunc() as f:
                 info = self.tarinfo(arcname)
-                f.seek(0, SEEK_END)
-                info.size = f.tell()
-                f.seek(0, SEEK_SET)
-                self.addfile(filter(info), f)
+                if isinstance(f, BytesIO):
+                    info.size = f.getbuffer().nbytes
+                else:
+                    f.seek(0, SEEK_END)
+                    info.size = f.tell()
+                    f.seek(0, SEEK_SET)
+                if filter is not None: info = filter(info)
+                if info is None: pass
+                elif (self._out_fd is not None and sendfile is not None
+                        and getattr(f, '_rolled', False)):
+                    # filter/template output that spilled its spool to disk
+                    # has a real fd; use the kernel-side copy
+                    self._sendfile(info, f)
+                else:
+                    self.addfile(info, f)
+        else:
+            info = self.tarinfo(arcname)
+            if filter is not None: info = filter(info)
+            if info is not None: self.addfile(info)
+
+    def _adddata(self, data, arcname=None, filter=None):
+        # in-memory payloads skip the file-object wrapper and the chunked
+        # copy loop in addfile: header, one write, padding
+        info = self.tarinfo(arcname)
+        info.size = len(data)
+        if filter is not None: info = filter(info)
+        if info is None or info.type == VIRTTYPE: return
+        self._check('aw')
+        buf = info.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(buf)
+        self.offset += len(buf)
+        if info.size > 0:
+            self.fileobj.write(data)
+            blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(info)
+
+    def _addinfo(self, info, source=None, filter=None, fileobj=None):
+        # counterpart to _add for members whose TarInfo was built at queue
+        # time; only regular files have data to copy
+        if filter is not None:
+            info = filter(info)
+        if info is None:
+            if fileobj is not None: fileobj.close()
+            return
+        if fileobj is not None:
+            with fileobj:
+                self.addfile(info, fileobj)
+        elif source is not None and info.isreg() and info.size != 0:
+            with open(source, 'rb') as f:
+                if self._out_fd is not None and sendfile is not None:
+                    self._sendfile(info, f)
+                else:
+                    self.addfile(info, f)
         else:
-            info = filter(self.tarinfo(arcname))
             self.addfile(info)
 
-    def addfile(self, tarinfo, fileobj=None):
-        if tarinfo.type != VIRTTYPE:
-            super().addfile(tarinfo, fileobj)
+    def _sendfile(self, info, f):
+        # uncompressed archive on a real fd: emit the header, let the
+        # kernel move the member data from f (positioned at 0), then pad
+        if info.type == VIRTTYPE: return
+        self._check('aw')
+        buf = info.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(buf)
+        # sendfile bypasses the userspace write buffer
+        self.fileobj.flush()
+        self.offset += len(buf)
+        out_fd, size = self._out_fd, info.size
+        in_fd, sent = f.fileno(), 0
+        while sent < size:
+            try:
+                n = sendfile(out_fd, in_fd, sent, size - sent)
+            except OSError:
+                # not supported here (filesystem/kernel); copy instead
+                if sent: raise
+                f.seek(0)
+                tarfile.copyfileobj(f, self.fileobj, size,
+                                    tarfile.ReadError, self.copybufsize)
+                break
+            if n == 0:
+                raise tarfile.ReadError('unexpected end of data')
+            sent += n
+        blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(info)
+
+    def gettarinfo(self, name=None, arcname=None, fileobj=None):
+        info = super().gettarinfo(name, arcname, fileobj)
+        if info is not None:
+            info.uname = _uname(info.uid)
+            info.gname = _gname(info.gid)
+        return info
+
+    def statinfo(self, arcname, st):
+        # build a TarInfo straight from an already-held stat result; covers
+        # the regular-file and directory shapes the walk produces so close
+        # time doesn't repeat the lstat gettarinfo would do. Anything else
+        # (links, devices, multi-link files) falls back to gettarinfo.
+        mode = st.st_mode
+        if S_ISREG(mode):
+            if st.st_nlink > 1: return None
+            type_, size = tarfile.REGTYPE, st.st_size
+        elif S_ISDIR(mode):
+            type_, size = tarfile.DIRTYPE, 0
+        else:
+            return None
+        info = self.tarinfo(arcname.replace(SEP, '/').lstrip('/'))
+        info.type, info.size = type_, size
+        info.mode = S_IMODE(mode)
+        info.uid, info.gid = st.st_uid, st.st_gid
+        info.mtime = st.st_mtime
+        info.uname, info.gname = _uname(st.st_uid), _gname(st.st_gid)
+        return info
 
     def queue(self, entry, fn=None):
         if isinstance(entry, (self.tarinfo, tarfile.TarInfo)):
-            thunk = partial(self.addfile, entry)
-            self.queued[entry.name] = QueuedInfo(entry.name, thunk)
+            # drop virtual members here rather than testing for them again
+            # on every addfile call
+            if entry.type != VIRTTYPE:
+                self.queued[entry.name] = QueuedInfo(entry.name, 'info', (entry,))
             return
 
-        src, dst, filter = entry.source, entry.name, entry.apply
-        isdir = False
+        src, dst = entry.source, entry.name
+        filter = None if entry.inert else entry.apply
+        isdir, payload = False, None
 
         if src:
             if src.startswith('base64:'):
-                fn = lambda: BytesIO(b64d(src[7:]))
+                # decode once now; the thunk only wraps the payload
+                payload = b64d(src[7:])
+                fn = lambda: BytesIO(payload)
             elif src.startswith('tar:'):
                 fn = lambda: tarmember(src)
             elif path.isdir(src):
@@ -575,13 +976,30 @@ class TarBuilder(tarfile.TarFile):
                 else: fn = partial(self._template, filename=src)
 
             if entry.filter:
-                if fn is not None: fn = partial(open, src, 'rb')
-                fn = cmd_filter(entry.filter, fn)
+                if fn is None: fn = partial(open, src, 'rb')
+                fn = partial(cmd_filter, entry.filter, fn)
 
-        if fn: thunk = partial(self._add, filefunc=fn, arcname=dst, filter=filter)
-        else: thunk = partial(self._add, filename=src, arcname=dst, filter=filter)
-
-        qi = QueuedInfo(src, thunk)
+        if fn:
+            if payload is not None and not (entry.template or entry.filter):
+                # plain base64 data needs no file object at all
+                qi = QueuedInfo(src, 'data', (payload, dst, filter))
+            else:
+                qi = QueuedInfo(src, 'func', (fn, dst, filter))
+        elif src:
+            # checks add() used to make for us: never archive the archive
+            # itself, and skip sockets and other types tar can't represent
+            if self.name is not None and path.abspath(src) == self.name:
+                return
+            # resolve the TarInfo now instead of letting add() redo the stat
+            # and name bookkeeping at close time; a stat primed by the walk
+            # skips even the one lstat gettarinfo would do
+            st = entry._stat
+            info = self.statinfo(dst, st) if st is not None else None
+            if info is None: info = self.gettarinfo(src, dst)
+            if info is None: return
+            qi = QueuedInfo(src, 'file', (info, src, filter))
+        else:
+            qi = QueuedInfo(src, 'none', (dst, filter))
 
         if isdir:
             if self.dirs == 'first':
@@ -593,11 +1011,69 @@ class TarBuilder(tarfile.TarFile):
         self.queued[dst] = qi
 
     def close(self):
-        # the thunk adds the item to the TarFile
-        for item in self.queued.values(): item.thunk()
-        super().close()
+        # overlap source reads with header formatting and compression: a
+        # blocking read() releases the GIL, so a small pool keeps the disk
+        # busy while the main thread compresses earlier members in order
+        pool = ThreadPoolExecutor(max_workers=4)
+        window = deque()
+
+        def prefetch(source):
+            with open(source, 'rb') as f:
+                return BytesIO(f.read())
+
+        def flush(n):
+            while len(window) > n:
+                info, src, filter, future = window.popleft()
+                self._addinfo(info, src, filter, fileobj=future.result())
 
-# pipe a file through a command
+        try:
+            addinfo, adddata, add = self._addinfo, self._adddata, self._add
+            for item in self.queued.values():
+                kind, args = item.kind, item.args
+                if kind == 'file':
+                    info, src, filter = args
+                    if (src is not None and info.isreg()
+                            and 0 < info.size <= (8 << 20)):
+                        # run the filter before the read: apply() may stat
+                        # the source, and reading first would clobber the
+                        # atime it records
+                        if filter is not None:
+                            info, filter = filter(info), None
+                            if info is None: continue
+                        window.append((info, src, filter,
+                                       pool.submit(prefetch, src)))
+                        flush(8)
+                        continue
+                    flush(0)
+                    addinfo(info, src, filter)
+                elif kind == 'data':
+                    flush(0)
+                    adddata(*args)
+                elif kind == 'func':
+                    fn, dst, filter = args
+                    flush(0)
+                    add(filefunc=fn, arcname=dst, filter=filter)
+                elif kind == 'info':
+                    flush(0)
+                    self.addfile(*args)
+                else:
+                    dst, filter = args
+                    flush(0)
+                    add(arcname=dst, filter=filter)
+            flush(0)
+        finally:
+            pool.shutdown(wait=False)
+        super().close()
+        proc = getattr(self, '_comp_proc', None)
+        if proc:
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        basefile = getattr(self, '_basefile', None)
+        if basefile: basefile.close()
+
+# pipe a file through one or more commands; stages are wired stdout->stdin
+# so they run concurrently instead of each one buffering the whole payload
 def cmd_filter(args, filefunc):
     if not isinstance(args, list):
         raise ValueError("Filter must be an argument list or list of lists!")
@@ -609,17 +1085,64 @@ def cmd_filter(args, filefunc):
     elif not isinstance(args[0], list):
         args = [args]
 
-    if isinstance(data, BufferedIOBase):
-        buf = data.read()
-        data.close()
-    else:
-        buf = data
+    # tar members arrive as TarInfo objects
+    if isinstance(data, tarfile.TarInfo): data = data.extractfile()
 
-    out = subprocess.check_output(args.pop(0), input=buf)
-    if isinstance(data, BufferedIOBase):
-        out = BytesIO(out)
+    # sources with a real file descriptor feed the first stage directly
+    try:
+        stdin, feed = data, data.fileno() is None
+    except (AttributeError, OSError):
+        stdin, feed = subprocess.PIPE, True
+
+    procs = []
+    for argv in args:
+        p = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.PIPE)
+        # close the parent's copy of the intermediate pipe so EOF propagates
+        if procs: stdin.close()
+        procs.append(p)
+        stdin = p.stdout
+
+    if feed:
+        def feed_input():
+            with data:
+                copyfileobj(data, procs[0].stdin, 1 << 20)
+            procs[0].stdin.close()
+        Thread(target=feed_input, daemon=True).start()
+    else:
+        data.close()
 
-    return cmd_filter(args, lambda: out) if len(args) else out
+    # tarfile needs the member size up front, so the final output still has
+    # to be collected; small results stay in memory, large ones spill to disk
+    out = SpooledTemporaryFile(max_size=(8 << 20))
+    copyfileobj(procs[-1].stdout, out, 1 << 20)
+    procs[-1].stdout.close()
+
+    for p, argv in zip(procs, args):
+        if p.wait() != 0:
+            raise subprocess.CalledProcessError(p.returncode, argv)
+
+    out.seek(0)
+    return out
+
+# os.walk minus the redundant stat round trip: yields DirEntry objects so
+# callers can reuse the stat results scandir already fetched
+def scanwalk(top):
+    stack = [top]
+    while stack:
+        top = stack.pop()
+        dirs, files = [], []
+        try:
+            with scandir(top) as it:
+                for entry in it:
+                    (dirs if entry.is_dir() else files).append(entry)
+        except OSError:
+            # match os.walk's default onerror=None: skip unreadable dirs
+            continue
+        yield top, dirs, files
+        # push in reverse so subdirectories come back out in scandir order
+        for entry in reversed(dirs):
+            if not entry.is_symlink():
+                stack.append(entry.path)
 
 def tar_entries(out, entries, **kwargs):
     with TarBuilder.open(out, **kwargs) as tar:
@@ -634,33 +1157,36 @@ def tar_entries(out, entries, **kwargs):
                 dstbase = entry.name
                 if dstbase != '' and dstbase[-1] != SEP: dstbase += SEP
 
-                for srcdir, dirnames, filenames in walk(srcbase):
+                # hoist the per-entry lookups; these loops run once per file
+                sub, queue, skip = entry.sub_factory(), tar.queue, len(srcbase)
+                for srcdir, dirents, filents in scanwalk(srcbase):
                     if srcdir[-1] != SEP: srcdir += SEP
-                    dstdir = dstbase + srcdir[len(srcbase):]
-                    filenames = chain(dirnames, filenames)
-                    for a in map(lambda x: entry.sub(srcdir+x, dstdir+x), filenames):
-                        tar.queue(a)
+                    # bind the prefix concatenations once per directory
+                    srcadd = srcdir.__add__
+                    dstadd = (dstbase + srcdir[skip:]).__add__
+                    for ent in dirents:
+                        queue(sub(srcadd(ent.name), dstadd(ent.name),
+                                  ent.stat(follow_symlinks=False)))
+                    for ent in filents:
+                        queue(sub(srcadd(ent.name), dstadd(ent.name),
+                                  ent.stat(follow_symlinks=False)))
 
 def create_tar(args):
     if args.compress is None:
         if args.outfile and isinstance(args.outfile.name, str):
-            suffix = path.splitext(args.outfile.name)[1]
-            # https://github.com/libarchive/libarchive/blob/0fd2ed25d78e9f4505de5dcb6208c6c0ff8d2edb/tar/creation_set.c#L114
-            if suffix in ('.gz', '.tgz', '.taz'):
-                args.compress = 'gz'
-            elif suffix in ('.bz2', '.tbz', '.tbz2', '.tz2'):
-                args.compress = 'bz2'
-            elif suffix in ('.xz', '.txz'):
-                args.compress = 'xz'
-            elif suffix in ('.zst', '.tzst'):
-                args.compress = 'zst'
-            else:
-                args.compress = ''
+            args.compress = EXTMAP[path.splitext(args.outfile.name)[1]]
         else:
             args.compress = ''
 
-    outfile = BytesIO() if args.zopfli else args.outfile
-    entries = flatten(map(concatjson.load, args.infiles))
+    # zopfli needs the whole archive up front; spool it so multi-GB inputs
+    # spill to disk instead of holding two copies in RAM
+    outfile = SpooledTemporaryFile(max_size=(64 << 20)) if args.zopfli \
+        else args.outfile
+    # parse every manifest before the archive build starts: input fds are
+    # released early and malformed JSON aborts before output is written;
+    # entry dicts are small, so holding them all is cheap
+    entries = list(flatten(map(concatjson.load, args.infiles)))
+    for f in args.infiles: f.close()
     tar_entries(
         outfile, entries,
         compress=args.compress,
@@ -672,7 +1198,15 @@ def create_tar(args):
 
     if args.zopfli:
         outfile.flush()
-        args.outfile.write(zopfli_compress(outfile.getvalue(), ifnone(args.level, 15)))
+        outfile.seek(0)
+        if getattr(outfile, '_rolled', False):
+            # spilled to disk: map it read-only so the compressor reads
+            # straight from the page cache, no bytes copy
+            import mmap
+            with mmap.mmap(outfile.fileno(), 0, prot=mmap.PROT_READ) as data:
+                args.outfile.write(zopfli_compress(data, ifnone(args.level, 15)))
+        else:
+            args.outfile.write(zopfli_compress(outfile.read(), ifnone(args.level, 15)))
         outfile.close()
 
     args.outfile.close()
@@ -680,6 +1214,14 @@ def create_tar(args):
 def create_manifest(args):
     import json
 
+    # one encoder for the whole run; orjson returns bytes directly
+    try:
+        from orjson import dumps as _dumps
+        encode = lambda obj: _dumps(obj) + b'\n'
+    except ImportError:
+        _encode = json.JSONEncoder(separators=(',', ':')).encode
+        encode = lambda obj: _encode(obj).encode() + b'\n'
+
     for fd in args.infiles:
         with tarfile.open(fileobj=fd.buffer) as tar:
             for info in tar:
@@ -698,14 +1240,11 @@ def create_manifest(args):
                     if 'atime' in pax: entry['atime'] = pax['atime']
                     if 'ctime' in pax: entry['ctime'] = pax['ctime']
 
-                args.outfile.write(json.dumps(entry).encode()+b'\n')
+                args.outfile.write(encode(entry))
 
 def main():
     from argparse import ArgumentParser, ArgumentTypeError, FileType, Action
 
-    class ParseError(Exception):
-        pass
-
     def DirectoryType(d):
         if path.isdir(d): return d
         else: raise ArgumentTypeError(f'{d} is not an accessible directory')
@@ -803,7 +1342,7 @@ def main():
         help='treat sources as relative to DIR'
     )
     parser.add_argument(
-        '-f', dest='outfile', type=FileType('wb'), metavar='FILE',
+        '-f', dest='outfile', type=FileType('wb', 1 << 20), metavar='FILE',
         help='output filename',
     )
     parser.add_argument(
@@ -818,45 +1357,21 @@ def main():
         args.compress = ''
 
     if args.outfile is None:
-        args.outfile = fdopen(sys.stdout.fileno(), "wb", closefd=False)
+        # buffer stdout generously; the default 8KiB means a write syscall
+        # per couple of tar blocks
+        args.outfile = fdopen(sys.stdout.fileno(), "wb", (1 << 20), closefd=False)
 
     if len(args.infiles) == 0:
         args.infiles.append(sys.stdin)
 
-    # parse template definitions
+    # parse template definitions; config's parser fast-paths the common
+    # unquoted KEY=value lines without touching the regex engine
     if args.definitions:
-        import json
-        decode = json.JSONDecoder().raw_decode
-        # We look for:
-        # * zero or more whitespace characters
-        # * either:
-        #   * a comment
-        #   * OR
-        #     * any number of word characters
-        #     * zero or more spaces
-        #     * an '='
-        #     * zero or more spaces
-        #     * either:
-        #       * a quoted string, optionally followed by a comment
-        #       * zero or more characters, optionally followed by a comment
-        comment = re.compile(r'\s*(?:#.*)?$')
-        sep = re.compile(r'\s*(?:(\s*(?:#.*)?)|(\w+)\s*=\s*(?:(".*)|(.*?)\s*(?:#.*)?))$')
-
+        from config import _parse_simple
         for f in args.definitions:
-            for lineno, line in enumerate(map(lambda x: x.strip(), f), 1):
-                m = sep.match(line)
-                if m is None:
-                    raise ParseError(f'Invalid syntax: {args.definitions.name}, line {lineno}')
-                _, k, q, v = m.groups()
-                if k:
-                    if q:
-                        v, w = decode(q)
-                        if not comment.match(q[w:]):
-                            raise ParseError(f'Invalid syntax: {args.definitions.name}, line {lineno}')
-
-                    if not args.define: args.define = {}
-                    # values defined in command line arguments take precedence
-                    if k not in args.define: args.define[k] = v
+            for k, v in _parse_simple(f).items():
+                # values defined in command line arguments take precedence
+                args.define.setdefault(k, v)
 
     if args.generate: create_manifest(args)
     else: create_tar(args)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import sys
-import operator
 import functools
 
 from collections.abc import Iterable
@@ -18,8 +17,12 @@ class Registrar(dict):
         self._default = None
 
     def __getitem__(self, key):
-        if self._default and key not in self: return self._default
-        else: return super().__getitem__(key)
+        # one dict probe on the hit path; only misses look at the default,
+        # and a registered-but-falsy default still counts
+        try: return super().__getitem__(key)
+        except KeyError:
+            if self._default is not None: return self._default
+            raise
 
     def register(self, *args, **kwargs):
         if len(args) == 1:
@@ -56,44 +59,61 @@ def defattr(obj, name, value):
         return True
     return False
 
-# @functools.cache is only in Python 3.9+, so provide fall back
-@export
-def memoize(fn):
-    return getattr(functools, 'cache', functools.lru_cache(maxsize=None))(fn)
+# @functools.cache is only in Python 3.9+, so provide fall back; alias the
+# C-implemented decorator directly rather than paying a wrapper per call
+memoize = getattr(functools, 'cache', None) or functools.lru_cache(maxsize=None)
+__all__.append('memoize')
 
 # @functools.cached_property is only in Python 3.8+, so provide fall back
-@export
-def cached_property(fn):
-    return getattr(functools, 'cached_property', lambda fn: property(memoize(fn)))(fn)
+cached_property = getattr(functools, 'cached_property', None) \
+    or (lambda fn: property(memoize(fn)))
+__all__.append('cached_property')
 
-# recursive flatten
+# iterative flatten; an explicit stack of iterators costs a loop pass per
+# element instead of a generator frame per nesting level
 @export
 def flatten(i, max_depth=-1):
-    if max_depth != 0 and isinstance(i, Iterable) and not isinstance(i, (dict, str, bytes)):
-        for s in i: yield from flatten(s, max_depth - 1)
-    else: yield i
-
+    stack = [(iter((i,)), max_depth)]
+    while stack:
+        it, depth = stack[-1]
+        for x in it:
+            if depth != 0 and isinstance(x, Iterable) \
+                    and not isinstance(x, (dict, str, bytes)):
+                stack.append((iter(x), depth - 1))
+                break
+            yield x
+        else:
+            stack.pop()
+
+# plain loops beat map/filter over a partial here: the predicate is a single
+# `in`, so the closure dispatch costs more than the test itself
 @export
 def anyin(obj, iterable):
-    return any(map(functools.partial(operator.contains, obj), iterable))
+    for x in iterable:
+        if x in obj: return True
+    return False
 
 @export
 def allin(obj, iterable):
-    return all(map(functools.partial(operator.contains, obj), iterable))
+    for x in iterable:
+        if x not in obj: return False
+    return True
 
 @export
 def countin(obj, iterable):
-    n, f = 0, filter(functools.partial(operator.contains, obj), iterable)
-    for _ in f: n += 1
+    n = 0
+    for x in iterable:
+        if x in obj: n += 1
     return n
 
 @export
 def gein(obj, count, iterable):
-    n, f = 0, filter(functools.partial(operator.contains, obj), iterable)
-    for _ in f:
-        n += 1
-        # early exit
-        if n >= count: return True
+    n = 0
+    for x in iterable:
+        if x in obj:
+            n += 1
+            # early exit
+            if n >= count: return True
 
     return False
 